@@ -21,6 +21,8 @@ local M = {}
 
 local strbyte = string.byte
 local strsub  = string.sub
+local strchar = string.char
+local strgsub = string.gsub
 
 local DEFAULT_ADDON_PREFIX = "qhstub_mmapdata"
 local DEFAULT_SHARD_DIM = 8
@@ -108,6 +110,57 @@ local function search_index(index, data, item)
   end
 end
 
+-- Flat index (index_format = "sorted"): adaptint N, N ascending key deltas, N lenMinus1.
+-- Blobs are back to back in key order, so offsets are the running sum of lengths.
+local function decode_sorted_index(index)
+  local n, cofs = read_adaptint(index, 1)
+  if not n then return nil end
+  local keys, offsets, lenm1s = {}, {}, {}
+  local key = 0
+  for i = 1, n do
+    local delta
+    delta, cofs = read_adaptint(index, cofs)
+    if not delta then return nil end
+    key = key + delta
+    keys[i] = key
+  end
+  local ofs = 1
+  for i = 1, n do
+    local lenm1
+    lenm1, cofs = read_adaptint(index, cofs)
+    if not lenm1 then return nil end
+    offsets[i] = ofs
+    lenm1s[i] = lenm1
+    ofs = ofs + lenm1 + 1
+  end
+  return keys, offsets, lenm1s
+end
+
+-- Decodes the store's sorted index once (cached on the store), then binary-searches it.
+local function search_sorted_index(store, data, item)
+  local keys = store._keys
+  if not keys then
+    if type(store.serialize_index) ~= "string" then return nil end
+    local offsets, lenm1s
+    keys, offsets, lenm1s = decode_sorted_index(store.serialize_index)
+    if not keys then return nil end
+    store._keys, store._offsets, store._lenm1s = keys, offsets, lenm1s
+  end
+  if type(data) ~= "string" or type(item) ~= "number" then return nil end
+
+  local lo, hi = 1, #keys
+  while lo <= hi do
+    local mid = math.floor((lo + hi) / 2)
+    local k = keys[mid]
+    if k == item then
+      local ofs = store._offsets[mid]
+      return strsub(data, ofs, ofs + store._lenm1s[mid])
+    end
+    if k < item then lo = mid + 1 else hi = mid - 1 end
+  end
+  return nil
+end
+
 -- ---------------------------------------------------------------------------
 -- Environment helpers
 -- ---------------------------------------------------------------------------
@@ -332,10 +385,99 @@ local function ensure_shard_loaded(dataDir, mapId, sx, sy)
   return not not get_shard_table(mapId, sx, sy)
 end
 
-local function decompress_deflate(comp)
+-- Stores written with --lua-encoding hex|base64 keep their blobs as ASCII text
+-- (store.encoding). They are decoded in place on first access.
+-- Both decoders are gsub passes over lookup tables (no Lua call per byte or quad):
+-- hex pairs map straight to bytes; base64 pairs (12 bits) map to three hex digits,
+-- which then go through the hex table. Unknown pairs are left in place, so a length
+-- mismatch on the result means malformed input.
+local HEX_BYTE = {}
+for i = 0, 255 do
+  local h = string.format("%02x", i)
+  HEX_BYTE[h] = strchar(i)
+  HEX_BYTE[string.upper(h)] = strchar(i)
+end
+
+local function decode_hex(s)
+  local out = strgsub(s, "..", HEX_BYTE)
+  if #out * 2 ~= #s then return nil, "bad hex" end
+  return out
+end
+
+local BASE64_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+local base64_pair_hex  -- built on first base64 store: 4096 entries, "AA" -> "000"
+
+local function decode_base64(s)
+  local n = #s
+  if n % 4 ~= 0 then return nil, "bad base64" end
+  if not base64_pair_hex then
+    base64_pair_hex = {}
+    for i = 1, 64 do
+      local c1 = strsub(BASE64_ALPHABET, i, i)
+      for j = 1, 64 do
+        base64_pair_hex[c1 .. strsub(BASE64_ALPHABET, j, j)] = string.format("%03x", (i - 1) * 64 + j - 1)
+      end
+    end
+  end
+  local pad = 0
+  if strsub(s, -2) == "==" then pad = 2 elseif strsub(s, -1) == "=" then pad = 1 end
+  if pad > 0 then s = strsub(s, 1, n - pad) .. string.rep("A", pad) end
+  local hex = strgsub(s, "..", base64_pair_hex)
+  if #hex * 2 ~= n * 3 then return nil, "bad base64" end
+  local out = strgsub(hex, "..", HEX_BYTE)
+  if pad > 0 then out = strsub(out, 1, #out - pad) end
+  return out
+end
+
+local BLOB_DECODERS = { base64 = decode_base64, hex = decode_hex }
+
+local function decode_store_blobs(store)
+  local enc = store.encoding
+  if enc == nil then return true end
+  local decode = BLOB_DECODERS[enc]
+  if not decode then return nil, "unknown encoding " .. tostring(enc) end
+  local index, index_err = decode(store.serialize_index)
+  if not index then return nil, index_err end
+  local data, data_err = decode(store.serialize_data)
+  if not data then return nil, data_err end
+  local dict = store.dict
+  if type(dict) == "string" then
+    local dict_err
+    dict, dict_err = decode(dict)
+    if not dict then return nil, dict_err end
+  end
+  store.serialize_index, store.serialize_data, store.dict = index, data, dict
+  store.encoding = nil
+  return true
+end
+
+-- Stores written with --deflate-dict-bytes carry a preset dictionary (store.dict plus
+-- its Adler-32). LibDeflate's dictionary object is built once per store and cached on it.
+local function get_store_dictionary(lib, store)
+  local dict = store._dictionary
+  if dict then return dict end
+  if type(lib.CreateDictionary) ~= "function" or type(lib.DecompressDeflateWithDict) ~= "function" then
+    return nil, "LibDeflate lacks dictionary support"
+  end
+  local ok, d = pcall(function()
+    return lib:CreateDictionary(store.dict, #store.dict, store.dict_adler32)
+  end)
+  if not ok or not d then return nil, "dictionary error" end
+  store._dictionary = d
+  return d
+end
+
+local function decompress_deflate(comp, store)
   local lib = get_libdeflate()
   if not lib then return nil, "LibDeflate missing" end
+  local dict
+  if store and type(store.dict) == "string" then
+    local dict_err
+    dict, dict_err = get_store_dictionary(lib, store)
+    if not dict then return nil, dict_err end
+  end
   local ok, out = pcall(function()
+    if dict then return lib:DecompressDeflateWithDict(comp, dict) end
     return lib:DecompressDeflate(comp)
   end)
   if not ok then return nil, "decompress error" end
@@ -343,6 +485,40 @@ local function decompress_deflate(comp)
   return out
 end
 
+-- Stores written with --solid-stores hold all tiles as ONE deflate stream; the index
+-- points into the inflated blob. Inflate once on first access and keep it on the store.
+local function solid_store_bytes(store)
+  local raw = store._raw
+  if raw then return raw end
+  local out, decomp_err = decompress_deflate(store.serialize_data)
+  if not out then return nil, decomp_err end
+  store._raw = out
+  return out
+end
+
+local TILE_MISSING = "not in index"
+
+-- Returns the tile's bytes, or nil plus TILE_MISSING (key not indexed) or an error string.
+local function read_store_tile(store, key)
+  local decoded, decode_err = decode_store_blobs(store)
+  if not decoded then return nil, decode_err end
+  local data = store.serialize_data
+  if store.solid then
+    local decomp_err
+    data, decomp_err = solid_store_bytes(store)
+    if not data then return nil, decomp_err end
+  end
+  local blob
+  if store.index_format == "sorted" then
+    blob = search_sorted_index(store, data, key)
+  else
+    blob = search_index(store.serialize_index, data, key)
+  end
+  if type(blob) ~= "string" or blob == "" then return nil, TILE_MISSING end
+  if store.solid then return blob end
+  return decompress_deflate(blob, store)
+end
+
 local function tile_key(tx, ty)
   return tx * 64 + ty + 1
 end
@@ -395,14 +571,13 @@ function M.loadNavTile(dataDir, mapId, tx, ty)
   end
 
   local key = tile_key(tx, ty)
-  local comp = search_index(nav.serialize_index, nav.serialize_data, key)
-  if type(comp) ~= "string" or comp == "" then
+  local bytes, decomp_err = read_store_tile(nav, key)
+  if decomp_err == TILE_MISSING then
     dbgf("mmaplua: nav tile (%d,%d) key=%d not in index (count=%s)",
       tx, ty, key, tostring(nav.count))
     return nil, path
   end
 
-  local bytes, decomp_err = decompress_deflate(comp)
   if type(bytes) ~= "string" or #bytes < 20 then
     err("nav tile (%d,%d) map=%d: decompression failed or too short (%s, len=%s)",
       tx, ty, mapId, tostring(decomp_err), tostring(bytes and #bytes or "nil"))
@@ -429,14 +604,13 @@ function M.loadTerrainTile(dataDir, mapId, tx, ty)
   end
 
   local key = tile_key(tx, ty)
-  local comp = search_index(terr.serialize_index, terr.serialize_data, key)
-  if type(comp) ~= "string" or comp == "" then
+  local bytes, decomp_err = read_store_tile(terr, key)
+  if decomp_err == TILE_MISSING then
     dbgf("mmaplua: terrain tile (%d,%d) key=%d not in index (count=%s)",
       tx, ty, key, tostring(terr.count))
     return nil, path -- missing terrain tile is OK
   end
 
-  local bytes, decomp_err = decompress_deflate(comp)
   if type(bytes) ~= "string" then
     err("terrain tile (%d,%d) map=%d: decompression failed (%s)",
       tx, ty, mapId, tostring(decomp_err))
@@ -22,29 +22,69 @@ Output structure (under --output-addons-dir):
 
 Compression:
   - raw DEFLATE stream (RFC1951, wbits=-15)
+  - uses libdeflate via the optional `deflate` package when installed
+    (pip install deflate), otherwise stdlib zlib
   - decompressed in Lua with LibDeflate:DecompressDeflate()
 
+  - optional (--deflate-dict-bytes): per-store preset dictionary, decompressed with
+    LibDeflate:DecompressDeflateWithDict()
+  - optional (--solid-stores): one stream per store, inflated once by the loader
+
 Indexing:
   - QuestHelper-style BST index using "adaptint" varints (see qhstub_db.lua search_index)
+  - optional (--index-format sorted): flat delta-coded arrays, binary-searched by the loader
 """
 
 from __future__ import annotations
 
 import argparse
+import base64
+import binascii
 import concurrent.futures
+import mmap
 import os
 import re
 import sys
 import zlib
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    # Optional libdeflate binding: ~2x faster than zlib for one-shot buffers and
+    # adds levels 10..12. Output is still plain raw DEFLATE.
+    import deflate as libdeflate
+except ImportError:
+    libdeflate = None
+
+
+# Dataset file names are fixed-width: <map:3>.mmap and <map:3><tx:2><ty:2><suffix>.
+MMAP_SUFFIX = ".mmap"
+NAV_TILE_SUFFIXES = (".mmtile", ".mmtil")  # tolerate typo
+TERRAIN_TILE_SUFFIX = ".map"
+
+# Shards handed to each worker per executor.map() dispatch.
+SHARD_JOB_CHUNKSIZE = 4
+
+
+def parse_mmap_name(name: str) -> Optional[int]:
+    # "000.mmap" -> map id
+    if len(name) != 3 + len(MMAP_SUFFIX) or not name.endswith(MMAP_SUFFIX):
+        return None
+    head = name[:3]
+    if not head.isdecimal():
+        return None
+    return int(head)
 
 
-MMAP_RE = re.compile(r"^(?P<map>\d{3})\.mmap$")
-MMTILE_RE = re.compile(r"^(?P<map>\d{3})(?P<tx>\d{2})(?P<ty>\d{2})\.mmtile$")
-MMTIL_RE = re.compile(r"^(?P<map>\d{3})(?P<tx>\d{2})(?P<ty>\d{2})\.mmtil$")  # tolerate typo
-MAP_RE = re.compile(r"^(?P<map>\d{3})(?P<tx>\d{2})(?P<ty>\d{2})\.map$")
+def parse_tile_name(name: str, suffix: str) -> Optional[Tuple[int, int, int]]:
+    # "0003217.mmtile" -> (map id, tx, ty)
+    if len(name) != 7 + len(suffix) or not name.endswith(suffix):
+        return None
+    head = name[:7]
+    if not head.isdecimal():
+        return None
+    return int(head[:3]), int(head[3:5]), int(head[5:7])
 
 
 def tile_key(tx: int, ty: int) -> int:
@@ -52,7 +92,12 @@ def tile_key(tx: int, ty: int) -> int:
     return tx * 64 + ty + 1
 
 
-def encode_adaptint(n: int) -> bytes:
+def shard_xy_key(tx: int, ty: int, shard_dim: int) -> int:
+    # Shard coordinates (sx, sy) packed as (sx << 8) | sy for the scan's per-map buckets.
+    return ((tx // shard_dim) << 8) | (ty // shard_dim)
+
+
+def _encode_adaptint_slow(n: int) -> bytes:
     # Base-128 little-endian varint with continuation flag in LSB.
     # Payload is stored in bits 1..7 as floor(byte/2).
     if n < 0:
@@ -70,37 +115,170 @@ def encode_adaptint(n: int) -> bytes:
     return bytes(out)
 
 
+# Every value that fits in one or two adaptint bytes. Tile keys (<= 4096), lenMinus1 and
+# rlink values almost always land here, so encoding is usually a single tuple index.
+ADAPTINT_SMALL_LIMIT = 1 << 14
+ADAPTINT_SMALL: Tuple[bytes, ...] = tuple(_encode_adaptint_slow(n) for n in range(ADAPTINT_SMALL_LIMIT))
+
+
+def encode_adaptint(n: int) -> bytes:
+    if 0 <= n < ADAPTINT_SMALL_LIMIT:
+        return ADAPTINT_SMALL[n]
+    return _encode_adaptint_slow(n)
+
+
+def _bst_preorder(n: int) -> List[Tuple[int, int]]:
+    # Pre-order walk of the implicit midpoint BST over n sorted keys, as [lo, hi) ranges.
+    # Empty ranges (lo >= hi) are the null children.
+    order: List[Tuple[int, int]] = []
+    stack = [(0, n)]
+    while stack:
+        lo, hi = stack.pop()
+        order.append((lo, hi))
+        if lo < hi:
+            mid = (lo + hi) // 2
+            stack.append((mid + 1, hi))
+            stack.append((lo, mid))
+    return order
+
+
 def build_bst_index(entries: Dict[int, Tuple[int, int]]) -> bytes:
     # entries: key -> (ofs, lenMinus1), where ofs is 1-based into serialize_data
+    #
+    # Column-wise pipeline instead of per-node recursion:
+    #   1. encode (key, ofs, lenMinus1) for every key in sorted order
+    #   2. linearize the midpoint BST into its pre-order range list
+    #   3. walk that list backwards (children before parents) to size subtrees -> rlink
+    #   4. join node headers in pre-order
     keys = sorted(entries.keys())
-
-    def rec(klist: List[int]) -> bytes:
-        if not klist:
-            return encode_adaptint(0)
-        mid = len(klist) // 2
-        k = klist[mid]
-        left = rec(klist[:mid])
-        right = rec(klist[mid + 1 :])
+    heads = [
+        encode_adaptint(k) + encode_adaptint(ofs) + encode_adaptint(lenm1)
+        for k, (ofs, lenm1) in zip(keys, map(entries.__getitem__, keys))
+    ]
+    order = _bst_preorder(len(keys))
+    null_node = encode_adaptint(0)
+    null_size = len(null_node)
+
+    sizes = [0] * len(keys)  # node position -> encoded byte length of its subtree
+    rlinks = [b""] * len(keys)
+    for lo, hi in reversed(order):
+        if lo >= hi:
+            continue
+        mid = (lo + hi) // 2
+        lsize = sizes[(lo + mid) // 2] if lo < mid else null_size
+        rsize = sizes[(mid + 1 + hi) // 2] if mid + 1 < hi else null_size
+        rlinks[mid] = encode_adaptint(lsize)
+        sizes[mid] = len(heads[mid]) + len(rlinks[mid]) + lsize + rsize
+
+    parts: List[bytes] = []
+    for lo, hi in order:
+        if lo >= hi:
+            parts.append(null_node)
+        else:
+            mid = (lo + hi) // 2
+            parts.append(heads[mid])
+            parts.append(rlinks[mid])
+    return b"".join(parts)
+
+
+def build_sorted_index(entries: Dict[int, Tuple[int, int]]) -> bytes:
+    # entries: key -> (ofs, lenMinus1), where ofs is 1-based into serialize_data
+    #
+    # Flat alternative to the BST (index_format = "sorted"):
+    #   adaptint N, then N key deltas (ascending keys, first delta from 0), then N lenMinus1.
+    # Blobs are laid out back to back in key order, so ofs is implied by the running sum of
+    # lengths and is not stored; neither is rlink. The loader decodes this once per store and
+    # binary-searches the keys.
+    keys = sorted(entries.keys())
+    parts = [encode_adaptint(len(keys))]
+    prev = 0
+    next_ofs = 1
+    for k in keys:
         ofs, lenm1 = entries[k]
-        rlink = len(left)
-        return (
-            encode_adaptint(k)
-            + encode_adaptint(ofs)
-            + encode_adaptint(lenm1)
-            + encode_adaptint(rlink)
-            + left
-            + right
-        )
+        if ofs != next_ofs:
+            raise ValueError(f"sorted index needs contiguous blobs in key order (key {k})")
+        next_ofs = ofs + lenm1 + 1
+        parts.append(encode_adaptint(k - prev))
+        prev = k
+    parts.extend(encode_adaptint(entries[k][1]) for k in keys)
+    return b"".join(parts)
 
-    return rec(keys)
 
+INDEX_BUILDERS = {
+    "bst": build_bst_index,
+    "sorted": build_sorted_index,
+}
 
-def deflate_raw(data: bytes, level: int) -> bytes:
+
+# zlib accepts 0..9; libdeflate additionally accepts 10..12.
+MAX_ZLIB_LEVEL = 9
+MAX_LIBDEFLATE_LEVEL = 12
+
+
+# zlib.compress() takes wbits from Python 3.11 on: one C call instead of building a
+# compressobj and calling compress() + flush().
+ZLIB_COMPRESS_HAS_WBITS = sys.version_info >= (3, 11)
+
+
+def deflate_raw(data: Union[bytes, mmap.mmap], level: int) -> bytes:
     # Raw DEFLATE (wbits=-15) to match LibDeflate:DecompressDeflate()
+    if libdeflate is not None and level > 0:
+        return libdeflate.deflate_compress(data, level)
+    if ZLIB_COMPRESS_HAS_WBITS:
+        return zlib.compress(data, level=level, wbits=-15)
     c = zlib.compressobj(level=level, wbits=-15)
     return c.compress(data) + c.flush()
 
 
+# BFINAL=1, BTYPE=01 (fixed Huffman), end-of-block: an empty last block.
+DEFLATE_FINAL_EMPTY_BLOCK = b"\x03\x00"
+
+
+class TileDeflater:
+    # Raw DEFLATE compressor reused across all tiles of a store.
+    #
+    # A fresh zlib compressobj allocates ~256 KiB of window/hash state, which dominated
+    # for small tiles. Python's zlib has no deflateReset(), so instead one stream is kept
+    # and every tile ends with Z_FULL_FLUSH: that byte-aligns the output and clears the
+    # match history, so the tile's segment never references earlier tiles. Appending an
+    # empty final block turns the segment into a complete raw DEFLATE stream (~6 bytes
+    # per tile over a one-shot stream).
+    #
+    # libdeflate has no per-call setup worth saving, so it is used one-shot as before.
+    #
+    # With a preset dictionary (zdict) the flush trick is unusable (a full flush also
+    # forgets the dictionary), so each tile gets a copy of a primed zlib stream instead,
+    # which at least skips re-hashing the dictionary per tile.
+
+    def __init__(self, level: int, zdict: bytes = b"") -> None:
+        self.level = level
+        self._zstream = None
+        self._primed = None
+        if zdict:
+            self._primed = zlib.compressobj(level=level, wbits=-15, zdict=zdict)
+        elif libdeflate is None or level == 0:
+            self._zstream = zlib.compressobj(level=level, wbits=-15)
+
+    def compress(self, data: Union[bytes, mmap.mmap]) -> bytes:
+        if self._primed is not None:
+            c = self._primed.copy()
+            return c.compress(data) + c.flush()
+        if self._zstream is None:
+            return deflate_raw(data, level=self.level)
+        z = self._zstream
+        return z.compress(data) + z.flush(zlib.Z_FULL_FLUSH) + DEFLATE_FINAL_EMPTY_BLOCK
+
+
+def deflate_file(path: Path, deflater: TileDeflater) -> bytes:
+    # Compress a tile straight from a read-only mapping of the file: both compressors take
+    # any buffer, so this skips the full-size bytes copy that read_bytes() would make.
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return deflater.compress(b"")  # empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return deflater.compress(mm)
+
+
 def lua_escape_byte(b: int, safe_ascii: bool) -> bytes:
     # Escape bytes for inclusion in a Lua short string literal.
     #
@@ -132,10 +310,36 @@ def lua_escape_byte(b: int, safe_ascii: bool) -> bytes:
     return bytes([b])
 
 
+# Per-byte escape tables (index = byte value), built once from lua_escape_byte().
+ESCAPE_RAW: Tuple[bytes, ...] = tuple(lua_escape_byte(b, safe_ascii=False) for b in range(256))
+ESCAPE_SAFE: Tuple[bytes, ...] = tuple(lua_escape_byte(b, safe_ascii=True) for b in range(256))
+
+# Raw mode writes all but a handful of bytes verbatim, so only those need substituting.
+_RAW_ESCAPE_RE = re.compile(
+    b"[" + b"".join(b"\\x%02x" % b for b in range(256) if ESCAPE_RAW[b] != bytes([b])) + b"]"
+)
+
+
+# Safe mode output is pure ASCII, so it can run as one str.translate() pass over the
+# latin-1 view of the bytes (a C loop with a 256-entry ordinal table).
+_ESCAPE_SAFE_STR: Tuple[str, ...] = tuple(e.decode("ascii") for e in ESCAPE_SAFE)
+
+
+def _escape_raw_match(m: "re.Match[bytes]") -> bytes:
+    return ESCAPE_RAW[m.group()[0]]
+
+
+def lua_escape_bytes(data: bytes, safe_ascii: bool) -> bytes:
+    # Escape a whole byte string; equivalent to joining lua_escape_byte() over data.
+    if safe_ascii:
+        return data.decode("latin-1").translate(_ESCAPE_SAFE_STR).encode("ascii")
+    return _RAW_ESCAPE_RE.sub(_escape_raw_match, data)
+
+
 def write_lua_short_string_literal(
-    fp, data: bytes, wrap_bytes: int = 120, safe_ascii: bool = False, cont_indent: bytes = b""
+    buf: bytearray, data: bytes, wrap_bytes: int = 120, safe_ascii: bool = False, cont_indent: bytes = b""
 ) -> None:
-    # Writes a Lua expression that evaluates to the byte string.
+    # Appends to buf a Lua expression that evaluates to the byte string.
     #
     # IMPORTANT: Do NOT use backslash-newline inside string literals.
     # In Lua 5.1, "A\<newline>B" inserts an actual newline byte (0x0A), corrupting binary streams.
@@ -145,41 +349,61 @@ def write_lua_short_string_literal(
     #   "part2" ..
     #   "part3"
     if wrap_bytes <= 0 or len(data) <= wrap_bytes:
-        fp.write(b'"')
-        for bb in data:
-            fp.write(lua_escape_byte(bb, safe_ascii=safe_ascii))
-        fp.write(b'"')
+        buf.extend(b'"')
+        buf.extend(lua_escape_bytes(data, safe_ascii=safe_ascii))
+        buf.extend(b'"')
         return
 
     # Use table.concat({ "chunk", "chunk", ... }) to avoid:
     # - inserting bytes (no backslash-newline tricks)
     # - Lua parser "too many syntax levels" from a huge .. chain
-    fp.write(b"table.concat({\n")
+    buf.extend(b"table.concat({\n")
     n = len(data)
     i = 0
     while i < n:
         j = min(i + wrap_bytes, n)
         if cont_indent:
-            fp.write(cont_indent)
-        fp.write(b"\t\"")
-        for bb in data[i:j]:
-            fp.write(lua_escape_byte(bb, safe_ascii=safe_ascii))
-        fp.write(b"\",\n")
+            buf.extend(cont_indent)
+        buf.extend(b"\t\"")
+        buf.extend(lua_escape_bytes(data[i:j], safe_ascii=safe_ascii))
+        buf.extend(b"\",\n")
         i = j
     if cont_indent:
-        fp.write(cont_indent)
-    fp.write(b"})")
+        buf.extend(cont_indent)
+    buf.extend(b"})")
 
 
 def write_lua_kv_string(
-    fp, key: str, data: bytes, indent: str = "\t", wrap_bytes: int = 120, safe_ascii: bool = False
+    buf: bytearray, key: str, data: bytes, indent: str = "\t", wrap_bytes: int = 120, safe_ascii: bool = False
 ) -> None:
-    fp.write(indent.encode("ascii"))
-    fp.write(key.encode("ascii"))
-    fp.write(b" = ")
+    buf.extend(indent.encode("ascii"))
+    buf.extend(key.encode("ascii"))
+    buf.extend(b" = ")
     ind = indent.encode("ascii")
-    write_lua_short_string_literal(fp, data, wrap_bytes=wrap_bytes, safe_ascii=safe_ascii, cont_indent=ind)
-    fp.write(b",\n")
+    write_lua_short_string_literal(buf, data, wrap_bytes=wrap_bytes, safe_ascii=safe_ascii, cont_indent=ind)
+    buf.extend(b",\n")
+
+
+# Store blobs may be written as ASCII text instead of escaped binary (--lua-encoding).
+# "raw" keeps the escaped-binary literals; the loader decodes hex/base64 once per store.
+LUA_BLOB_ENCODERS = {
+    "raw": None,
+    "hex": binascii.hexlify,
+    "base64": base64.b64encode,
+}
+
+
+def read_file_head(path: Union[str, Path], size: int) -> bytes:
+    # Only the leading dtNavMeshParams are needed: a raw fd + pread() skips building a
+    # buffered file object (and, unlike read_bytes(), never reads the whole file).
+    if not hasattr(os, "pread"):  # Windows
+        with open(path, "rb") as f:
+            return f.read(size)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.pread(fd, size, 0)
+    finally:
+        os.close(fd)
 
 
 def write_text_file(path: Path, text: str) -> None:
@@ -223,21 +447,104 @@ class TileRef:
         raise RuntimeError("shard_xy requires shard_dim; compute externally")
 
 
-def _build_store(tile_paths: Dict[int, Path], level: int) -> Tuple[bytes, bytes, int]:
-    # Returns (serialize_index, serialize_data, count)
+# LibDeflate:CreateDictionary() accepts at most one DEFLATE window.
+MAX_DICT_BYTES = 32768
+
+
+def pick_store_dict(tile_paths: Dict[int, Path], dict_bytes: int) -> bytes:
+    # Every .mmtile/.map starts with the same fixed-layout headers (magic, version,
+    # dtMeshHeader / map header), so the leading bytes of the first tile make a cheap
+    # preset dictionary for the rest of the store. A lone tile has nothing to share with.
+    if dict_bytes <= 0 or len(tile_paths) < 2:
+        return b""
+    with open(tile_paths[min(tile_paths)], "rb") as f:
+        return f.read(dict_bytes)
+
+
+@dataclass
+class Store:
+    # One nav or terrain store of a shard, as written to data.lua.
+    serialize_index: bytes
+    serialize_data: bytes
+    count: int
+    dict: bytes = b""
+    solid: bool = False
+    index_format: str = "bst"
+
+
+def _build_store(
+    tile_paths: Dict[int, Path], level: int, dict_bytes: int = 0, index_format: str = "bst"
+) -> Store:
     if not tile_paths:
-        return encode_adaptint(0), b"", 0
+        return Store(INDEX_BUILDERS[index_format]({}), b"", 0, index_format=index_format)
 
+    zdict = pick_store_dict(tile_paths, dict_bytes)
+    deflater = TileDeflater(level, zdict=zdict)
     data_blob = bytearray()
     entries: Dict[int, Tuple[int, int]] = {}
     for k in sorted(tile_paths.keys()):
-        raw = tile_paths[k].read_bytes()
-        comp = deflate_raw(raw, level=level)
+        comp = deflate_file(tile_paths[k], deflater)
         ofs = len(data_blob) + 1  # 1-based for Lua
         data_blob.extend(comp)
         entries[k] = (ofs, len(comp) - 1)
-    index_blob = build_bst_index(entries)
-    return index_blob, bytes(data_blob), len(tile_paths)
+    index_blob = INDEX_BUILDERS[index_format](entries)
+    return Store(index_blob, bytes(data_blob), len(tile_paths), dict=zdict, index_format=index_format)
+
+
+def _build_solid_store(tile_paths: Dict[int, Path], level: int, index_format: str = "bst") -> Store:
+    # Solid layout: all raw tiles of the store are concatenated in key order and compressed
+    # as ONE stream, so the LZ77 window also matches across tiles. The index then points
+    # into the *decompressed* blob. Empty tiles cannot be indexed (lenMinus1 would be -1)
+    # and are left out, i.e. they read as missing.
+    raw_blob = bytearray()
+    entries: Dict[int, Tuple[int, int]] = {}
+    for k in sorted(tile_paths.keys()):
+        raw = tile_paths[k].read_bytes()
+        if not raw:
+            continue
+        entries[k] = (len(raw_blob) + 1, len(raw) - 1)
+        raw_blob.extend(raw)
+    index_blob = INDEX_BUILDERS[index_format](entries)
+    return Store(index_blob, deflate_raw(raw_blob, level=level), len(entries), solid=True, index_format=index_format)
+
+
+def write_lua_store(buf: bytearray, name: str, store: Store, safe_ascii: bool, encoding: str = "raw") -> None:
+    encode = LUA_BLOB_ENCODERS[encoding]
+
+    def blob(data: bytes) -> bytes:
+        return encode(data) if encode else data
+
+    buf.extend(f"\t{name} = {{\n".encode("ascii"))
+    write_lua_kv_string(
+        buf, "serialize_index", blob(store.serialize_index), indent="\t\t", wrap_bytes=120, safe_ascii=safe_ascii
+    )
+    write_lua_kv_string(
+        buf, "serialize_data", blob(store.serialize_data), indent="\t\t", wrap_bytes=120, safe_ascii=safe_ascii
+    )
+    buf.extend(f"\t\tcount = {store.count},\n".encode("ascii"))
+    if encode:
+        buf.extend(f'\t\tencoding = "{encoding}",\n'.encode("ascii"))
+    if store.dict:
+        write_lua_kv_string(buf, "dict", blob(store.dict), indent="\t\t", wrap_bytes=120, safe_ascii=safe_ascii)
+        buf.extend(f"\t\tdict_adler32 = {zlib.adler32(store.dict)},\n".encode("ascii"))
+    if store.solid:
+        buf.extend(b"\t\tsolid = true,\n")
+    if store.index_format != "bst":
+        buf.extend(f'\t\tindex_format = "{store.index_format}",\n'.encode("ascii"))
+    buf.extend(b"\t},\n")
+
+
+SHARD_LUA_HEADER = (
+    b"-- data.lua (generated)\n"
+    b"MmapLuaDB = MmapLuaDB or {}\n"
+    b"MmapLuaDB.shards = MmapLuaDB.shards or {}\n"
+    b"local mapId = %d\n"
+    b"local sx = %d\n"
+    b"local sy = %d\n"
+    b"MmapLuaDB.shards[mapId] = MmapLuaDB.shards[mapId] or {}\n"
+    b"MmapLuaDB.shards[mapId][sx] = MmapLuaDB.shards[mapId][sx] or {}\n"
+    b"MmapLuaDB.shards[mapId][sx][sy] = {\n"
+)
 
 
 def _generate_shard(
@@ -251,6 +558,10 @@ def _generate_shard(
     interface: int,
     level: int,
     safe_ascii: bool,
+    dict_bytes: int,
+    solid: bool,
+    index_format: str,
+    encoding: str,
 ) -> str:
     # Runs in a worker process. Returns the addon name on success.
     addon_name = f"{addon_prefix}_{map_id:03d}_{sx:02d}_{sy:02d}"
@@ -273,35 +584,28 @@ def _generate_shard(
     )
     write_text_file(shard_dir / f"{addon_name}.toc", toc_text)
 
-    nav_index, nav_data, nav_count = _build_store(nav_map, level)
-    terr_index, terr_data, terr_count = _build_store(terr_map, level)
+    if solid:
+        nav = _build_solid_store(nav_map, level, index_format)
+        terrain = _build_solid_store(terr_map, level, index_format)
+    else:
+        nav = _build_store(nav_map, level, dict_bytes, index_format)
+        terrain = _build_store(terr_map, level, dict_bytes, index_format)
 
     lua_path = shard_dir / "data.lua"
-    with lua_path.open("wb") as fp:
-        fp.write(b"-- data.lua (generated)\n")
-        fp.write(b"MmapLuaDB = MmapLuaDB or {}\n")
-        fp.write(b"MmapLuaDB.shards = MmapLuaDB.shards or {}\n")
-        fp.write(f"local mapId = {map_id}\n".encode("ascii"))
-        fp.write(f"local sx = {sx}\n".encode("ascii"))
-        fp.write(f"local sy = {sy}\n".encode("ascii"))
-        fp.write(b"MmapLuaDB.shards[mapId] = MmapLuaDB.shards[mapId] or {}\n")
-        fp.write(b"MmapLuaDB.shards[mapId][sx] = MmapLuaDB.shards[mapId][sx] or {}\n")
-        fp.write(b"MmapLuaDB.shards[mapId][sx][sy] = {\n")
-        fp.write(b"\tnav = {\n")
-        write_lua_kv_string(fp, "serialize_index", nav_index, indent="\t\t", wrap_bytes=120, safe_ascii=safe_ascii)
-        write_lua_kv_string(fp, "serialize_data", nav_data, indent="\t\t", wrap_bytes=120, safe_ascii=safe_ascii)
-        fp.write(f"\t\tcount = {nav_count},\n".encode("ascii"))
-        fp.write(b"\t},\n")
-        fp.write(b"\tterrain = {\n")
-        write_lua_kv_string(fp, "serialize_index", terr_index, indent="\t\t", wrap_bytes=120, safe_ascii=safe_ascii)
-        write_lua_kv_string(fp, "serialize_data", terr_data, indent="\t\t", wrap_bytes=120, safe_ascii=safe_ascii)
-        fp.write(f"\t\tcount = {terr_count},\n".encode("ascii"))
-        fp.write(b"\t},\n")
-        fp.write(b"}\n")
+    buf = bytearray(SHARD_LUA_HEADER % (map_id, sx, sy))
+    write_lua_store(buf, "nav", nav, safe_ascii, encoding)
+    write_lua_store(buf, "terrain", terrain, safe_ascii, encoding)
+    buf.extend(b"}\n")
+    lua_path.write_bytes(buf)
 
     return addon_name
 
 
+def _generate_shard_job(job: Tuple) -> str:
+    # executor.map() passes a single argument per call; unpack the job tuple.
+    return _generate_shard(*job)
+
+
 def parse_args(argv: List[str]) -> argparse.Namespace:
     ap = argparse.ArgumentParser(description="Convert .mmap/.mmtile/.map dataset to sharded Lua blob addons.")
     ap.add_argument("--input-data-dir", required=True, help="Directory containing mmaps/ and maps/ subfolders.")
@@ -309,7 +613,34 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
     ap.add_argument("--addon-prefix", default="qhstub_mmapdata", help="Core addon folder/name prefix.")
     ap.add_argument("--shard-dim", type=int, default=8, help="Shard dimension in tiles (default 8).")
     ap.add_argument("--interface", type=int, default=30300, help="WoW Interface number for generated .toc files.")
-    ap.add_argument("--compression-level", type=int, default=6, help="zlib compression level 0..9 (raw deflate).")
+    ap.add_argument(
+        "--compression-level",
+        type=int,
+        default=6,
+        help="DEFLATE compression level 0..9 (raw deflate); 10..12 require the optional "
+        "'deflate' (libdeflate) package.",
+    )
+    ap.add_argument(
+        "--deflate-dict-bytes",
+        type=int,
+        default=0,
+        help="Compress each nav/terrain store against a preset DEFLATE dictionary of up to this many "
+        f"bytes (1..{MAX_DICT_BYTES}; taken from the store's first tile and stored in the shard). "
+        "Shrinks stores of many small tiles with shared headers. Default 0 = off. Uses zlib.",
+    )
+    ap.add_argument(
+        "--solid-stores",
+        action="store_true",
+        help="Compress each nav/terrain store as one DEFLATE stream instead of per tile. Much smaller "
+        "output (matches span tiles), but the loader inflates the whole store on first access.",
+    )
+    ap.add_argument(
+        "--index-format",
+        choices=sorted(INDEX_BUILDERS),
+        default="bst",
+        help="serialize_index encoding: 'bst' (QuestHelper-style BST, default) or 'sorted' "
+        "(flat delta-coded key/length arrays; smaller, binary-searched by the loader).",
+    )
     ap.add_argument(
         "--manifest",
         default="",
@@ -322,6 +653,14 @@ def parse_args(argv: List[str]) -> argparse.Namespace:
         help="Escape control/high bytes so generated .lua files are ASCII-safe "
         "(slower/larger, but avoids Ctrl+Z issues in some Windows Lua interpreters).",
     )
+    ap.add_argument(
+        "--lua-encoding",
+        choices=list(LUA_BLOB_ENCODERS),
+        default="raw",
+        help="How shard blobs are written: 'raw' (escaped binary literals, default), 'hex' or 'base64' "
+        "(plain ASCII, decoded once per store by the loader). base64 is ~1.33x the blob size versus "
+        "~2-2.5x for --lua-safe-ascii escapes.",
+    )
     ap.add_argument(
         "--libdeflate-src",
         default="",
@@ -356,11 +695,23 @@ def main(argv: List[str]) -> int:
     interface = int(args.interface)
     level = int(args.compression_level)
     safe_ascii = bool(args.lua_safe_ascii)
+    dict_bytes = int(args.deflate_dict_bytes)
+    solid = bool(args.solid_stores)
+    index_format = str(args.index_format)
+    encoding = str(args.lua_encoding)
 
     if shard_dim <= 0 or shard_dim > 64:
         raise SystemExit("--shard-dim must be in 1..64")
-    if level < 0 or level > 9:
-        raise SystemExit("--compression-level must be in 0..9")
+    if level < 0 or level > MAX_LIBDEFLATE_LEVEL:
+        raise SystemExit(f"--compression-level must be in 0..{MAX_LIBDEFLATE_LEVEL}")
+    if level > MAX_ZLIB_LEVEL and libdeflate is None:
+        raise SystemExit("--compression-level 10..12 requires the 'deflate' package (pip install deflate)")
+    if dict_bytes < 0 or dict_bytes > MAX_DICT_BYTES:
+        raise SystemExit(f"--deflate-dict-bytes must be in 0..{MAX_DICT_BYTES}")
+    if dict_bytes and level > MAX_ZLIB_LEVEL:
+        raise SystemExit("--deflate-dict-bytes uses zlib; --compression-level must be in 0..9")
+    if dict_bytes and solid:
+        raise SystemExit("--deflate-dict-bytes and --solid-stores are mutually exclusive")
 
     mmaps_dir = input_dir / "mmaps"
     maps_dir = input_dir / "maps"
@@ -377,8 +728,9 @@ def main(argv: List[str]) -> int:
     # Scan input dataset
     # ---------------------------------------------------------------------
     params_by_map: Dict[int, bytes] = {}
-    nav_tiles: Dict[Tuple[int, int, int], Dict[int, Path]] = {}      # (map,sx,sy) -> {tileKey: path}
-    terr_tiles: Dict[Tuple[int, int, int], Dict[int, Path]] = {}     # (map,sx,sy) -> {tileKey: path}
+    # map -> (sx << 8) | sy -> {tileKey: path}; packed ints avoid a tuple per tile.
+    nav_tiles: Dict[int, Dict[int, Dict[int, Path]]] = {}
+    terr_tiles: Dict[int, Dict[int, Dict[int, Path]]] = {}
     maps_seen: set[int] = set()
 
     if args.manifest:
@@ -409,102 +761,88 @@ def main(argv: List[str]) -> int:
             name = p.name
 
             if parent == "mmaps":
-                m = MMAP_RE.match(name)
-                if m:
-                    map_id = int(m.group("map"))
+                map_id = parse_mmap_name(name)
+                if map_id is not None:
                     if restrict_maps is not None and map_id not in restrict_maps:
                         continue
                     maps_seen.add(map_id)
-                    head = p.read_bytes()[:28]
+                    head = read_file_head(p, 28)
                     if len(head) < 28:
                         print(f"WARNING: {p} is too short for dtNavMeshParams (need 28 bytes)", file=sys.stderr)
                         continue
                     params_by_map[map_id] = head
                     continue
 
-                m = MMTILE_RE.match(name) or MMTIL_RE.match(name)
-                if m:
-                    map_id = int(m.group("map"))
+                t = parse_tile_name(name, NAV_TILE_SUFFIXES[0]) or parse_tile_name(name, NAV_TILE_SUFFIXES[1])
+                if t:
+                    map_id, tx, ty = t
                     if restrict_maps is not None and map_id not in restrict_maps:
                         continue
-                    tx = int(m.group("tx"))
-                    ty = int(m.group("ty"))
                     maps_seen.add(map_id)
-                    sx = tx // shard_dim
-                    sy = ty // shard_dim
-                    shard = (map_id, sx, sy)
-                    nav_tiles.setdefault(shard, {})[tile_key(tx, ty)] = p
+                    shard_xy = shard_xy_key(tx, ty, shard_dim)
+                    nav_tiles.setdefault(map_id, {}).setdefault(shard_xy, {})[tile_key(tx, ty)] = p
                     continue
 
             if parent == "maps":
-                m = MAP_RE.match(name)
-                if m:
-                    map_id = int(m.group("map"))
+                t = parse_tile_name(name, TERRAIN_TILE_SUFFIX)
+                if t:
+                    map_id, tx, ty = t
                     if restrict_maps is not None and map_id not in restrict_maps:
                         continue
-                    tx = int(m.group("tx"))
-                    ty = int(m.group("ty"))
                     maps_seen.add(map_id)
-                    sx = tx // shard_dim
-                    sy = ty // shard_dim
-                    shard = (map_id, sx, sy)
-                    terr_tiles.setdefault(shard, {})[tile_key(tx, ty)] = p
+                    shard_xy = shard_xy_key(tx, ty, shard_dim)
+                    terr_tiles.setdefault(map_id, {}).setdefault(shard_xy, {})[tile_key(tx, ty)] = p
                     continue
 
     else:
-        # .mmap params files
-        for ent in mmaps_dir.iterdir():
-            if not ent.is_file():
-                continue
-            m = MMAP_RE.match(ent.name)
-            if not m:
-                continue
-            map_id = int(m.group("map"))
-            if restrict_maps is not None and map_id not in restrict_maps:
-                continue
-            maps_seen.add(map_id)
-            with ent.open("rb") as f:
-                head = f.read(28)
-            if len(head) < 28:
-                print(f"WARNING: {ent} is too short for dtNavMeshParams (need 28 bytes)", file=sys.stderr)
-                continue
-            params_by_map[map_id] = head
+        # os.scandir() DirEntry.is_file() answers from the readdir() d_type on most
+        # filesystems, so non-matching entries never cost a stat() or a Path object.
+
+        # Every input name starts with the zero-padded 3-digit map id, so --map-ids
+        # rejects foreign entries on that prefix before any parsing.
+        map_prefixes = None if restrict_maps is None else {f"{m:03d}" for m in restrict_maps}
+
+        # One pass over mmaps/ picks up both .mmap params and .mmtile nav tiles.
+        with os.scandir(mmaps_dir) as it:
+            for ent in it:
+                name = ent.name
+                if map_prefixes is not None and name[:3] not in map_prefixes:
+                    continue
+                map_id = parse_mmap_name(name)
+                if map_id is not None:
+                    if not ent.is_file():
+                        continue
+                    maps_seen.add(map_id)
+                    head = read_file_head(ent.path, 28)
+                    if len(head) < 28:
+                        print(f"WARNING: {ent.path} is too short for dtNavMeshParams (need 28 bytes)", file=sys.stderr)
+                        continue
+                    params_by_map[map_id] = head
+                    continue
 
-        # .mmtile nav tiles
-        for ent in mmaps_dir.iterdir():
-            if not ent.is_file():
-                continue
-            m = MMTILE_RE.match(ent.name) or MMTIL_RE.match(ent.name)
-            if not m:
-                continue
-            map_id = int(m.group("map"))
-            if restrict_maps is not None and map_id not in restrict_maps:
-                continue
-            tx = int(m.group("tx"))
-            ty = int(m.group("ty"))
-            maps_seen.add(map_id)
-            sx = tx // shard_dim
-            sy = ty // shard_dim
-            shard = (map_id, sx, sy)
-            nav_tiles.setdefault(shard, {})[tile_key(tx, ty)] = ent
+                t = parse_tile_name(name, NAV_TILE_SUFFIXES[0]) or parse_tile_name(name, NAV_TILE_SUFFIXES[1])
+                if not t or not ent.is_file():
+                    continue
+                map_id, tx, ty = t
+                maps_seen.add(map_id)
+                shard_xy = shard_xy_key(tx, ty, shard_dim)
+                key = (tx << 6) + ty + 1  # tile_key(tx, ty), inlined for the scan loop
+                nav_tiles.setdefault(map_id, {}).setdefault(shard_xy, {})[key] = Path(ent.path)
 
         # .map terrain tiles
-        for ent in maps_dir.iterdir():
-            if not ent.is_file():
-                continue
-            m = MAP_RE.match(ent.name)
-            if not m:
-                continue
-            map_id = int(m.group("map"))
-            if restrict_maps is not None and map_id not in restrict_maps:
-                continue
-            tx = int(m.group("tx"))
-            ty = int(m.group("ty"))
-            maps_seen.add(map_id)
-            sx = tx // shard_dim
-            sy = ty // shard_dim
-            shard = (map_id, sx, sy)
-            terr_tiles.setdefault(shard, {})[tile_key(tx, ty)] = ent
+        with os.scandir(maps_dir) as it:
+            for ent in it:
+                name = ent.name
+                if map_prefixes is not None and name[:3] not in map_prefixes:
+                    continue
+                t = parse_tile_name(name, TERRAIN_TILE_SUFFIX)
+                if not t or not ent.is_file():
+                    continue
+                map_id, tx, ty = t
+                maps_seen.add(map_id)
+                shard_xy = shard_xy_key(tx, ty, shard_dim)
+                key = (tx << 6) + ty + 1  # tile_key(tx, ty), inlined for the scan loop
+                terr_tiles.setdefault(map_id, {}).setdefault(shard_xy, {})[key] = Path(ent.path)
 
     if not maps_seen:
         print("No maps found. Expected files like mmaps/000.mmap and mmaps/0000000.mmtile", file=sys.stderr)
@@ -552,56 +890,64 @@ def main(argv: List[str]) -> int:
     write_text_file(core_toc, core_toc_text)
 
     # Core DB file (binary Lua)
-    with core_db.open("wb") as fp:
-        fp.write(b"-- MmapLuaDB_Core.lua (generated)\n")
-        fp.write(b"MmapLuaDB = MmapLuaDB or {}\n")
-        fp.write(b"MmapLuaDB.config = MmapLuaDB.config or {}\n")
-        fp.write(b"MmapLuaDB.config.format_version = 1\n")
-        fp.write(f"MmapLuaDB.config.shard_dim = {shard_dim}\n".encode("ascii"))
-        fp.write(f'MmapLuaDB.config.addon_prefix = "{addon_prefix}"\n'.encode("ascii"))
-        fp.write(f"MmapLuaDB.config.interface_version = {interface}\n".encode("ascii"))
-        fp.write(b"MmapLuaDB.params = MmapLuaDB.params or {}\n")
-        fp.write(b"MmapLuaDB.shards = MmapLuaDB.shards or {}\n")
-        fp.write(b"\n")
-
-        for map_id in sorted(maps_seen):
-            params = params_by_map.get(map_id)
-            if not params:
-                # No params means PathFinder will be unable to init this map; still record missing.
-                continue
-            fp.write(f"MmapLuaDB.params[{map_id}] = ".encode("ascii"))
-            write_lua_short_string_literal(fp, params, wrap_bytes=120, safe_ascii=safe_ascii, cont_indent=b"")
-            fp.write(b"\n")
+    buf = bytearray()
+    buf.extend(b"-- MmapLuaDB_Core.lua (generated)\n")
+    buf.extend(b"MmapLuaDB = MmapLuaDB or {}\n")
+    buf.extend(b"MmapLuaDB.config = MmapLuaDB.config or {}\n")
+    buf.extend(b"MmapLuaDB.config.format_version = 1\n")
+    buf.extend(f"MmapLuaDB.config.shard_dim = {shard_dim}\n".encode("ascii"))
+    buf.extend(f'MmapLuaDB.config.addon_prefix = "{addon_prefix}"\n'.encode("ascii"))
+    buf.extend(f"MmapLuaDB.config.interface_version = {interface}\n".encode("ascii"))
+    buf.extend(b"MmapLuaDB.params = MmapLuaDB.params or {}\n")
+    buf.extend(b"MmapLuaDB.shards = MmapLuaDB.shards or {}\n")
+    buf.extend(b"\n")
+
+    for map_id in sorted(maps_seen):
+        params = params_by_map.get(map_id)
+        if not params:
+            # No params means PathFinder will be unable to init this map; still record missing.
+            continue
+        buf.extend(f"MmapLuaDB.params[{map_id}] = ".encode("ascii"))
+        write_lua_short_string_literal(buf, params, wrap_bytes=120, safe_ascii=safe_ascii, cont_indent=b"")
+        buf.extend(b"\n")
+    core_db.write_bytes(buf)
 
     # ---------------------------------------------------------------------
     # Generate shard addons
     # ---------------------------------------------------------------------
-    # Union of shard keys across nav and terrain
-    shard_keys = set(nav_tiles.keys()) | set(terr_tiles.keys())
-    shard_keys = {k for k in shard_keys if (restrict_maps is None or k[0] in restrict_maps)}
-
     workers = args.workers if args.workers > 0 else None  # None -> ProcessPoolExecutor uses cpu_count()
 
-    shard_jobs = [
-        (
-            output_dir,
-            addon_prefix,
-            map_id, sx, sy,
-            nav_tiles.get((map_id, sx, sy), {}),
-            terr_tiles.get((map_id, sx, sy), {}),
-            interface,
-            level,
-            safe_ascii,
-        )
-        for (map_id, sx, sy) in sorted(shard_keys)
-    ]
+    # Union of shards across nav and terrain, in (map, sx, sy) order.
+    shard_jobs = []
+    for map_id in sorted(nav_tiles.keys() | terr_tiles.keys()):
+        if restrict_maps is not None and map_id not in restrict_maps:
+            continue
+        nav_shards = nav_tiles.get(map_id, {})
+        terr_shards = terr_tiles.get(map_id, {})
+        for shard_xy in sorted(nav_shards.keys() | terr_shards.keys()):
+            shard_jobs.append(
+                (
+                    output_dir,
+                    addon_prefix,
+                    map_id, shard_xy >> 8, shard_xy & 0xFF,
+                    nav_shards.get(shard_xy, {}),
+                    terr_shards.get(shard_xy, {}),
+                    interface,
+                    level,
+                    safe_ascii,
+                    dict_bytes,
+                    solid,
+                    index_format,
+                    encoding,
+                )
+            )
 
     total = len(shard_jobs)
     done = 0
     with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
-        futures = {executor.submit(_generate_shard, *job): job for job in shard_jobs}
-        for fut in concurrent.futures.as_completed(futures):
-            addon_name = fut.result()  # raises on worker exception
+        # Batch several shards per IPC round-trip; small shards are cheap enough that
+        # per-job pickling/dispatch would otherwise dominate.
+        for addon_name in executor.map(_generate_shard_job, shard_jobs, chunksize=SHARD_JOB_CHUNKSIZE):
             done += 1
             print(f"[{done}/{total}] {addon_name}")
 
@@ -3,156 +3,431 @@
 test_mmap_luadb_roundtrip.py
 
 Self-test for the sharded Lua blob format produced by convert_mmaps_to_lua.py:
-  - Generates a tiny fake dataset (mmaps/maps) with one map and a few tiles
-  - Runs convert_mmaps_to_lua.py with a manifest restricting to those files
-  - Parses the generated Lua shard file (data.lua) to extract serialize_index/data
+  - Generates small fake datasets (mmaps/maps): a tiny one, and one spread over
+    several shards with escape-heavy payloads large enough for table.concat literals
+  - Runs convert_mmaps_to_lua.py on each, across a matrix of options (shard size,
+    manifest vs directory scan, safe-ascii, dict, solid, sorted index, encodings)
+  - Parses every generated Lua shard file (data.lua) to extract the store fields
   - Performs index lookup and raw-deflate decompression
   - Verifies recovered bytes match the originals
 
+Variants run in parallel, one per worker process.
+
 This does NOT require Lua. It's meant to sanity-check the converter/index logic.
 """
 
 from __future__ import annotations
 
+import base64
+import binascii
+import bisect
+import hashlib
+import mmap
+import multiprocessing
 import os
+import random
 import re
+import subprocess
+import sys
 import tempfile
+from array import array
+from dataclasses import dataclass
+from itertools import accumulate
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple, Union
 
 import zlib
 
+try:  # optional: pip install deflate (libdeflate bindings), as in the converter
+    import deflate as libdeflate
+except ImportError:
+    libdeflate = None
 
-def decode_adaptint(data: bytes, offset: int) -> Tuple[int, int]:
-    stx = 0
-    acu = 1
-    while True:
-        if offset >= len(data):
-            raise ValueError("adaptint OOB")
-        v = data[offset]
-        stx += acu * (v // 2)
-        offset += 1
-        acu *= 128
-        if (v % 2) == 0:
-            break
-    return stx, offset
 
+def decode_all_adaptints(data: bytes) -> List[int]:
+    # Decode every adaptint in the buffer in one pass (7-bit payload, LSB=1 means "more").
+    # This is the whole hot loop of index parsing: shifts/masks only, append bound once.
+    vals: List[int] = []
+    append = vals.append
+    acc = 0
+    shift = 0
+    for v in data:
+        acc |= (v >> 1) << shift
+        if v & 1:
+            shift += 7
+        else:
+            append(acc)
+            acc = 0
+            shift = 0
+    if shift:
+        raise ValueError("adaptint OOB")
+    return vals
 
-def search_index(index: bytes, blob: bytes, item: int) -> bytes | None:
-    cofs = 0
-    while True:
-        idx, cofs = decode_adaptint(index, cofs)
-        if idx == 0:
-            return None
-        ofs, cofs = decode_adaptint(index, cofs)
-        ln1, cofs = decode_adaptint(index, cofs)
-        rlink, cofs = decode_adaptint(index, cofs)
-        if idx == item:
-            start = ofs - 1
-            end = start + ln1 + 1
-            return blob[start:end]
-        if idx < item:
-            cofs += rlink
-
-
-def lua_unescape_short_string(lit: str) -> bytes:
+
+@dataclass
+class IndexTable:
+    # A parsed serialize_index as parallel int64 columns sorted by key. rlink is what the
+    # Lua loader's BST walk follows: parse_index() checks every rlink against the encoded
+    # left-subtree size before dropping it, since lookups here bisect the keys instead.
+    keys: array
+    ofs: array
+    ln1: array
+
+
+def parse_index(index: bytes) -> IndexTable:
+    # The BST index is a pre-order stream of (idx, ofs, ln1, rlink) nodes where a lone
+    # idx=0 marks an empty subtree, so n keys take exactly 5n+1 values. Its shape is the
+    # midpoint BST over the sorted keys, fixed by n alone. Walking that shape visits the
+    # nodes in key order (no sort needed) and checks what the loader's rlink walk relies on:
+    #   - in-order keys strictly increase, i.e. every node sits at its midpoint slot
+    #   - rlink is the byte length of the node's left-subtree encoding
+    vals = decode_all_adaptints(index)
+    ends = [i + 1 for i, v in enumerate(index) if not v & 1]  # byte offset past each value
+    n, extra = divmod(len(vals) - 1, 5)
+    if n < 0 or extra:
+        raise ValueError(f"BST index holds {len(vals)} adaptints, not 5n+1")
+    keys = array("q")
+    ofs = array("q")
+    ln1 = array("q")
+
+    def walk(j: int, lo: int, hi: int) -> int:
+        # Subtree over in-order ranks [lo, hi) encoded from value j; returns the value after it.
+        if lo >= hi:
+            if vals[j] != 0:
+                raise ValueError(f"expected empty subtree, got key {vals[j]}")
+            return j + 1
+        mid = (lo + hi) // 2
+        key = vals[j]
+        right = walk(j + 4, lo, mid)
+        if vals[j + 3] != ends[right - 1] - ends[j + 3]:
+            raise ValueError(f"key {key}: rlink {vals[j + 3]} != left subtree size {ends[right - 1] - ends[j + 3]}")
+        if key <= (keys[-1] if keys else 0):
+            raise ValueError(f"key {key} out of BST pre-order")
+        keys.append(key)
+        ofs.append(vals[j + 1])
+        ln1.append(vals[j + 2])
+        return walk(right, mid + 1, hi)
+
+    walk(0, 0, n)
+    return IndexTable(keys, ofs, ln1)
+
+
+def parse_sorted_index(index: bytes) -> IndexTable:
+    # --index-format sorted: adaptint N, N key deltas, then N lenMinus1. Blobs are back
+    # to back in key order from ofs 1, so ofs is the running sum; rlink is not stored.
+    vals = decode_all_adaptints(index)
+    if not vals or len(vals) != 1 + 2 * vals[0]:
+        raise ValueError("malformed sorted index")
+    n = vals[0]
+    ln1 = array("q", vals[1 + n :])
+    ofs = array("q")
+    next_ofs = 1
+    for length_m1 in ln1:
+        ofs.append(next_ofs)
+        next_ofs += length_m1 + 1
+    return IndexTable(array("q", accumulate(vals[1 : 1 + n])), ofs, ln1)
+
+
+def search_index(table: IndexTable, blob: bytes, item: int) -> bytes | None:
+    i = bisect.bisect_left(table.keys, item)
+    if i == len(table.keys) or table.keys[i] != item:
+        return None
+    start = table.ofs[i] - 1
+    return blob[start : start + table.ln1[i] + 1]
+
+
+def inflate_raw(comp: bytes, size: int, out: bytearray, zdict: bytes = b"") -> bytes | memoryview:
+    # size: expected decompressed length; libdeflate needs the output size up front.
+    # out: reusable buffer (len >= size) that the zlib path inflates into, so the
+    # result is a view of it rather than a fresh bytes object per tile.
+    # zdict: preset dictionary (--deflate-dict-bytes); only zlib supports it.
+    if libdeflate is not None and not zdict:
+        return libdeflate.deflate_decompress(comp, size)
+    mv = memoryview(out)
+    d = zlib.decompressobj(wbits=-15, zdict=zdict) if zdict else zlib.decompressobj(wbits=-15)
+    n = 0
+    while not d.eof:
+        if not comp:
+            raise ValueError("deflate stream truncated")
+        # One byte of slack so a stream that exactly fills the buffer still reaches eof.
+        room = len(out) - n
+        chunk = d.decompress(comp, room + 1)
+        if len(chunk) > room:
+            raise ValueError("deflate stream larger than buffer")
+        mv[n : n + len(chunk)] = chunk
+        n += len(chunk)
+        comp = d.unconsumed_tail
+    return mv[:n]
+
+
+_SIMPLE_ESCAPES = {0x6E: 10, 0x72: 13, 0x22: 34}  # \n \r \"
+
+
+def lua_unescape_short_string(lit: bytes) -> bytes:
     # Input is the inside of quotes, after removing the opening/closing quote.
-    out = bytearray()
-    i = 0
-    n = len(lit)
+    # Split on backslashes: every part after the first starts with an escape head and
+    # continues with verbatim bytes, so the runs between escapes are copied in bulk.
+    parts = lit.split(b"\\")
+    out = bytearray(parts[0])
+    i = 1
+    n = len(parts)
     while i < n:
-        ch = lit[i]
-        if ch != "\\":
-            out.append(ord(ch))
-            i += 1
-            continue
-        # backslash escape
-        if i + 1 >= n:
-            raise ValueError("dangling backslash")
-        nxt = lit[i + 1]
-        if nxt == "\n":
-            # Lua line continuation: backslash + newline => nothing
-            i += 2
-            continue
-        if nxt == "n":
-            out.append(10)
-            i += 2
-            continue
-        if nxt == "r":
-            out.append(13)
-            i += 2
-            continue
-        if nxt == "\\":
+        part = parts[i]
+        if not part:
+            # Two adjacent backslashes: an escaped "\\"; the next part is all verbatim.
+            if i + 1 >= n:
+                raise ValueError("dangling backslash")
             out.append(92)
+            out += parts[i + 1]
             i += 2
             continue
-        if nxt == '"':
-            out.append(34)
-            i += 2
-            continue
-        if nxt.isdigit():
-            # \000 style (exactly 3 digits in our generator)
-            if i + 4 > n:
+        head = part[0]
+        byte = _SIMPLE_ESCAPES.get(head)
+        if byte is not None:
+            out.append(byte)
+            out += part[1:]
+        elif head == 0x0A:
+            # Lua line continuation: backslash + newline => nothing
+            out += part[1:]
+        elif 0x30 <= head <= 0x39:
+            # \000 style (exactly 3 digits in our generator); decode the digits directly
+            # instead of slicing out a 3-byte string for int().
+            if len(part) < 3 or not (0x30 <= part[1] <= 0x39 and 0x30 <= part[2] <= 0x39):
                 raise ValueError("short \\ddd escape")
-            ddd = lit[i + 1 : i + 4]
-            out.append(int(ddd, 10))
-            i += 4
-            continue
-        # Unknown escape
-        raise ValueError(f"unknown escape: \\{nxt!r}")
+            out.append(head * 100 + part[1] * 10 + part[2] - 0x30 * 111)
+            out += part[3:]
+        else:
+            raise ValueError(f"unknown escape: \\{chr(head)!r}")
+        i += 1
     return bytes(out)
 
 
-def extract_lua_string_assignment(src: str, key: str) -> bytes:
-    # Find: key = "....",
-    # Parse the short string literal with escapes.
-    m = re.search(rf"{re.escape(key)}\s*=\s*\"", src)
+def _literal_end(src: Union[bytes, mmap.mmap], i: int) -> int:
+    # Index of the quote closing the literal whose body starts at i: the next '"'
+    # preceded by an even run of backslashes. find() does the scanning in C instead of
+    # a per-character Python loop.
+    end = i
+    while True:
+        end = src.find(b'"', end)
+        if end < 0:
+            raise ValueError("unterminated string literal")
+        j = end
+        while j > i and src[j - 1] == 0x5C:
+            j -= 1
+        if (end - j) % 2 == 0:
+            return end
+        end += 1
+
+
+# Find: key = "....",  or, for literals over 120 bytes,
+#       key = table.concat({ "...", "...", }),
+_ASSIGN_RES = {
+    key: re.compile(re.escape(key.encode("ascii")) + rb'\s*=\s*(table\.concat\(\{\s*)?"')
+    for key in ("serialize_index", "serialize_data", "dict")
+}
+_CONCAT_NEXT_RE = re.compile(rb',\s*"')
+_CONCAT_END_RE = re.compile(rb',?\s*\}\)')
+
+
+def extract_lua_string_assignment(
+    src: Union[bytes, mmap.mmap], key: str, start: int = 0, stop: int = -1
+) -> Tuple[bytes, int]:
+    # Parse the short string literal(s) assigned to key, with escapes. The assignment is
+    # searched in src[start:stop] without slicing src; returns the value and the offset
+    # just past it, so the next field can be searched from there.
+    m = _ASSIGN_RES[key].search(src, start, len(src) if stop < 0 else stop)
     if not m:
         raise ValueError(f"missing assignment for {key}")
     i = m.end()  # position after opening quote
-    buf = []
-    while i < len(src):
-        ch = src[i]
-        if ch == '"':
+    end = _literal_end(src, i)
+    if not m.group(1):
+        return lua_unescape_short_string(src[i:end]), end + 1
+    # No escape spans two literals, so the escaped bodies can be joined and unescaped once.
+    bodies = [src[i:end]]
+    while True:
+        nxt = _CONCAT_NEXT_RE.match(src, end + 1)
+        if not nxt:
             break
-        buf.append(ch)
-        i += 1
+        i = nxt.end()
+        end = _literal_end(src, i)
+        bodies.append(src[i:end])
+    close = _CONCAT_END_RE.match(src, end + 1)
+    if not close:
+        raise ValueError(f"unterminated table.concat for {key}")
+    return lua_unescape_short_string(b"".join(bodies)), close.end()
+
+
+# Scalar store fields: count, dict_adler32, solid, index_format, encoding.
+_STORE_FIELD_RE = re.compile(rb'^\t\t(\w+) = "?(\w+)"?,$', re.M)
+_BLOB_DECODERS = {b"base64": base64.b64decode, b"hex": binascii.unhexlify}
+
+
+def tile_digest(data: bytes | memoryview) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+# tileKey -> (raw size, tile_digest(raw)): the fixtures are hashed once, and the
+# verification never needs the expected payloads themselves.
+ExpectedTiles = Dict[int, Tuple[int, bytes]]
+
+
+def verify_store(src: Union[bytes, mmap.mmap], start: int, stop: int, expected: ExpectedTiles) -> None:
+    # src[start:stop]: one store table (nav = {...} or terrain = {...}) of a shard's data.lua.
+    # Every expected tile must be found and match.
+    fields = dict(_STORE_FIELD_RE.findall(src, start, stop))
+    assert int(fields[b"count"]) == len(expected), (fields[b"count"], len(expected))
+
+    # Fields are written in this order; each search resumes where the previous ended.
+    index, pos = extract_lua_string_assignment(src, "serialize_index", start, stop)
+    data, pos = extract_lua_string_assignment(src, "serialize_data", pos, stop)
+    zdict = extract_lua_string_assignment(src, "dict", pos, stop)[0] if b"dict_adler32" in fields else b""
+    encoding = fields.get(b"encoding")
+    if encoding is not None:
+        decode = _BLOB_DECODERS[encoding]
+        index, data, zdict = decode(index), decode(data), decode(zdict)
+    if zdict:
+        assert zlib.adler32(zdict) == int(fields[b"dict_adler32"])
+
+    if fields.get(b"index_format") == b"sorted":
+        table = parse_sorted_index(index)
     else:
-        raise ValueError("unterminated string literal")
-    inner = "".join(buf)
-    return lua_unescape_short_string(inner)
+        table = parse_index(index)
+    assert len(table.keys) == len(expected)
+    if not expected:
+        return
 
+    solid = fields.get(b"solid") == b"true"
+    if solid:
+        # One stream for the whole store; the index addresses the inflated bytes.
+        total = sum(size for size, _ in expected.values())
+        data = bytes(inflate_raw(data, total, bytearray(total)))
 
-def run() -> None:
-    here = Path(__file__).resolve()
-    convert_py = here.parent / "convert_mmaps_to_lua.py"
-    assert convert_py.is_file(), convert_py
+    # Both the index and the expected tiles are sorted by key and equally many, so one
+    # merge walk pairs them up; no per-tile index search.
+    out = bytearray(max(size for size, _ in expected.values()))
+    for idx, ofs, ln1, (k, (size, digest)) in zip(table.keys, table.ofs, table.ln1, sorted(expected.items())):
+        assert idx == k, (idx, k)
+        blob = data[ofs - 1 : ofs + ln1]
+        got = blob if solid else inflate_raw(blob, size, out, zdict)
+        assert tile_digest(got) == digest, k
 
-    with tempfile.TemporaryDirectory() as td:
-        root = Path(td)
-        input_dir = root / "data"
-        (input_dir / "mmaps").mkdir(parents=True, exist_ok=True)
-        (input_dir / "maps").mkdir(parents=True, exist_ok=True)
+    # Point lookups must still miss keys that are not stored (probe each key's neighbour).
+    for k in expected:
+        if k + 1 not in expected:
+            assert search_index(table, data, k + 1) is None, k + 1
 
-        # Fake files
-        map_id = 0
-        mmap_path = input_dir / "mmaps" / f"{map_id:03d}.mmap"
-        mmap_path.write_bytes(b"A" * 28 + b"EXTRA")
 
-        tiles = {
+def _payload(rng: random.Random, size: int) -> bytes:
+    # Biased toward bytes the Lua writer must escape (and ones --lua-safe-ascii escapes),
+    # with enough entropy that compressed blobs exceed one 120-byte literal.
+    alphabet = b'\\"\n\r\x00\x1b\x7f\x80\xff' * 4 + bytes(range(32, 127))
+    return bytes(rng.choice(alphabet) for _ in range(size))
+
+
+def build_configs() -> List[dict]:
+    tiny = {
+        "map_id": 0,
+        "shard_dim": 8,
+        "manifest": True,
+        "tiles": {
             (0, 0): b"TILE00" * 10,
             (1, 2): b"TILE12" * 7 + b"\x00\x01\x02\xff",
-        }
-        maps = {
+        },
+        "maps": {
             (0, 0): b"MAP00" * 9,
-        }
+        },
+    }
+
+    # Spread over several shards (including tile 63 edges); sizes from 1 byte up.
+    rng = random.Random(1234)
+    coords = [(tx, ty) for tx in (0, 1, 7, 8, 31, 63) for ty in (0, 5, 8, 63)]
+    sizes = [1, 2, 119, 120, 121] + [rng.randint(1, 3000) for _ in coords]
+    wide = {
+        "map_id": 530,
+        "shard_dim": 8,
+        "manifest": False,
+        "tiles": {xy: _payload(rng, size) for xy, size in zip(coords, sizes)},
+        "maps": {xy: _payload(rng, rng.randint(1, 1500)) for xy in coords[::3]},
+    }
+    # Zero-byte tiles, sharing a shard with non-empty ones (so the min-key dict source stays non-empty).
+    wide["tiles"][(8, 6)] = b""
+    wide["maps"][(31, 9)] = b""
+
+    return [
+        {**tiny, "name": "tiny", "args": []},
+        {**tiny, "name": "tiny-safe", "args": ["--lua-safe-ascii"]},
+        {**wide, "name": "wide", "args": []},
+        {**wide, "name": "wide-safe-dim4", "shard_dim": 4, "args": ["--lua-safe-ascii"]},
+        {**wide, "name": "wide-manifest-dim1", "shard_dim": 1, "manifest": True, "args": []},
+        {**wide, "name": "wide-stored", "args": ["--compression-level", "0"]},
+        {**wide, "name": "wide-dict", "args": ["--deflate-dict-bytes", "256"]},
+        {**wide, "name": "wide-solid", "args": ["--solid-stores"]},
+        {**wide, "name": "wide-sorted", "args": ["--index-format", "sorted", "--lua-safe-ascii"]},
+        {**wide, "name": "wide-base64-dict", "args": ["--lua-encoding", "base64", "--deflate-dict-bytes", "256"]},
+        {
+            **wide,
+            "name": "wide-hex-sorted-solid",
+            "args": ["--lua-encoding", "hex", "--index-format", "sorted", "--solid-stores"],
+        },
+    ]
 
-        for (tx, ty), raw in tiles.items():
-            (input_dir / "mmaps" / f"{map_id:03d}{tx:02d}{ty:02d}.mmtile").write_bytes(raw)
-        for (tx, ty), raw in maps.items():
-            (input_dir / "maps" / f"{map_id:03d}{tx:02d}{ty:02d}.map").write_bytes(raw)
 
-        # Manifest
+_DUMP_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+
+def _dump(files: List[Tuple[Path, bytes]]) -> None:
+    # Write fixture files with raw fds: no Path.write_bytes()/buffered file object each.
+    for path, data in files:
+        fd = os.open(path, _DUMP_FLAGS, 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view) :]
+        finally:
+            os.close(fd)
+
+
+def run_one(config: dict, root: Path) -> None:
+    # root: this variant's own (not yet existing) work directory.
+    here = Path(__file__).resolve()
+    convert_py = here.parent / "convert_mmaps_to_lua.py"
+    assert convert_py.is_file(), convert_py
+
+    map_id: int = config["map_id"]
+    shard_dim: int = config["shard_dim"]
+    tiles: Dict[Tuple[int, int], bytes] = config["tiles"]
+    maps: Dict[Tuple[int, int], bytes] = config["maps"]
+
+    root.mkdir()
+    input_dir = root / "data"
+    (input_dir / "mmaps").mkdir(parents=True, exist_ok=True)
+    (input_dir / "maps").mkdir(parents=True, exist_ok=True)
+
+    # Fake files
+    _dump(
+        [
+            (input_dir / "mmaps" / f"{map_id:03d}.mmap", b"A" * 28 + b"EXTRA"),
+            *((input_dir / "mmaps" / f"{map_id:03d}{tx:02d}{ty:02d}.mmtile", raw) for (tx, ty), raw in tiles.items()),
+            *((input_dir / "maps" / f"{map_id:03d}{tx:02d}{ty:02d}.map", raw) for (tx, ty), raw in maps.items()),
+        ]
+    )
+
+    out_addons = root / "addons"
+    addon_prefix = "qhstub_mmapdata_test"
+    # The matrix already runs variants in parallel; keep each converter to one worker.
+    argv = [
+        sys.executable,
+        str(convert_py),
+        "--input-data-dir", str(input_dir),
+        "--output-addons-dir", str(out_addons),
+        "--addon-prefix", addon_prefix,
+        "--shard-dim", str(shard_dim),
+        "--workers", "1",
+        "--no-copy-libdeflate",
+        *config["args"],
+    ]
+
+    if config["manifest"]:
         manifest = root / "manifest.txt"
         manifest.write_text(
             "\n".join(
@@ -166,56 +441,49 @@ def run() -> None:
             encoding="utf-8",
             newline="\n",
         )
+        argv += ["--manifest", str(manifest)]
 
-        out_addons = root / "addons"
-        addon_prefix = "qhstub_mmapdata_test"
+    # argv list with the running interpreter: no shell, no quoting, no PATH lookup.
+    subprocess.run(argv, check=True, stdout=subprocess.DEVNULL)
 
-        cmd = (
-            f"python \"{convert_py}\" "
-            f"--input-data-dir \"{input_dir}\" "
-            f"--output-addons-dir \"{out_addons}\" "
-            f"--addon-prefix \"{addon_prefix}\" "
-            f"--manifest \"{manifest}\" "
-            f"--no-copy-libdeflate"
-        )
-        rc = os.system(cmd)
-        if rc != 0:
-            raise RuntimeError(f"converter failed (exit {rc})")
-
-        # Find shard for tiles above with shard_dim default 8 => sx,sy = 0,0 for both
-        shard_dir = out_addons / f"{addon_prefix}_{map_id:03d}_00_00"
-        data_lua = shard_dir / "data.lua"
-        # Read as latin-1 to preserve raw bytes 0..255 in the file.
-        src = data_lua.read_text(encoding="latin-1")
-
-        nav_index = extract_lua_string_assignment(src, "serialize_index")
-        nav_data = extract_lua_string_assignment(src, "serialize_data")
-
-        for (tx, ty), raw in tiles.items():
-            k = tx * 64 + ty + 1
-            comp = search_index(nav_index, nav_data, k)
-            assert comp is not None, (tx, ty)
-            got = zlib.decompress(comp, wbits=-15)
-            assert got == raw, (tx, ty)
-
-        terr_index = extract_lua_string_assignment(src, "serialize_index")  # first match is nav; crude
-        # Better: slice after "terrain = {" for terrain fields.
-        terrain_pos = src.find("terrain")
-        assert terrain_pos >= 0
-        terr_src = src[terrain_pos:]
-        terr_index = extract_lua_string_assignment(terr_src, "serialize_index")
-        terr_data = extract_lua_string_assignment(terr_src, "serialize_data")
-
-        for (tx, ty), raw in maps.items():
-            k = tx * 64 + ty + 1
-            comp = search_index(terr_index, terr_data, k)
-            assert comp is not None, (tx, ty)
-            got = zlib.decompress(comp, wbits=-15)
-            assert got == raw, (tx, ty)
-
-        print("OK: roundtrip converter/index/deflate verified on tiny dataset")
+    # Expected contents per shard: (sx, sy) -> (nav tiles, terrain tiles)
+    # Solid stores leave empty tiles out of the index and count; the shard is still written.
+    solid = "--solid-stores" in config["args"]
+    shards: Dict[Tuple[int, int], Tuple[ExpectedTiles, ExpectedTiles]] = {}
+    for which, src_tiles in enumerate((tiles, maps)):
+        for (tx, ty), raw in src_tiles.items():
+            shard = shards.setdefault((tx // shard_dim, ty // shard_dim), ({}, {}))
+            if raw or not solid:
+                shard[which][tx * 64 + ty + 1] = (len(raw), tile_digest(raw))
+
+    shard_names = {f"{addon_prefix}_{map_id:03d}_{sx:02d}_{sy:02d}" for (sx, sy) in shards}
+    generated = {p.name for p in out_addons.iterdir()} - {addon_prefix}
+    assert generated == shard_names, (config["name"], sorted(generated ^ shard_names))
+
+    for (sx, sy), (nav_expected, terr_expected) in shards.items():
+        data_lua = out_addons / f"{addon_prefix}_{map_id:03d}_{sx:02d}_{sy:02d}" / "data.lua"
+        # The literals hold raw bytes 0..255; scan the file as bytes through a
+        # read-only mapping so only the touched pages are read, never a full copy.
+        with open(data_lua, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as src:
+            nav_pos = src.find(b"\tnav = {")
+            terrain_pos = src.find(b"\tterrain = {", nav_pos)
+            assert 0 <= nav_pos < terrain_pos, (config["name"], sx, sy)
+            verify_store(src, nav_pos, terrain_pos, nav_expected)
+            verify_store(src, terrain_pos, len(src), terr_expected)
+
+
+def run() -> None:
+    configs = build_configs()
+    # All variants share one parent tempdir (one cleanup), on tmpfs when there is one.
+    shm = "/dev/shm"
+    tmp_root = shm if os.path.isdir(shm) and os.access(shm, os.W_OK) else None
+    with tempfile.TemporaryDirectory(dir=tmp_root) as parent:
+        jobs = [(config, Path(parent) / f"cfg_{i}") for i, config in enumerate(configs)]
+        # Variants are independent (own subdir, own converter process): one per worker.
+        with multiprocessing.Pool(min(len(configs), os.cpu_count() or 1)) as pool:
+            pool.starmap(run_one, jobs)
+    print(f"OK: roundtrip converter/index/deflate verified on {len(configs)} dataset variants")
 
 
 if __name__ == "__main__":
     run()
-